@@ -1,15 +1,28 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, field_validator
-from typing import Dict, Any, List
-from datetime import datetime
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, PrivateAttr, field_validator
+from typing import Dict, Any, List, NamedTuple, Optional, Tuple
+from array import array
+from bisect import bisect_right
+from datetime import datetime, timezone
+from functools import lru_cache
 from pathlib import Path
 import json
+import os
 import re
+import time
+
+import orjson
 
 # ==========
 # App
 # ==========
+class ORJSONResponse(JSONResponse):
+    # fastapi.responses.ORJSONResponse は新しめの FastAPI で非推奨になったため自前で定義
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content)
+
 app = FastAPI(
     title="Soul Theme Diagnosis API",
     version="1.1.0",
@@ -17,23 +30,28 @@ app = FastAPI(
         "Birthdate → Dragon Head zodiac → Soul Theme (●-●) + Reverse Theme (●-●). "
         "Uses official master JSON files only (no hard-coded astrology)."
     ),
-)
-
-# （ブラウザから叩くツール用に許可。不要なら削除OK）
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
+    default_response_class=ORJSONResponse,
 )
 
 DATA_DIR = (Path(__file__).resolve().parent.parent / "data").resolve()
+RANGES_PATH = DATA_DIR / "dragon_head_ranges.json"
+ZMAP_PATH = DATA_DIR / "zodiac_theme_map.json"
+
+# 開発用: MASTER_RELOAD=1 ならマスタJSONの更新（mtime変化）を検知して再読込する
+MASTER_RELOAD = os.getenv("MASTER_RELOAD") == "1"
 
 # -------------------------
 # 日付正規化（多形式対応）
 # -------------------------
 FULL2HALF = str.maketrans("０１２３４５６７８９／－．", "0123456789/-.")
 
+# 区切り付き YYYY?MM?DD と 日本語 YYYY年M月D日 を1回の fullmatch で判別する
+_RE_DATE = re.compile(
+    r"(?P<y1>\d{4})[/. -](?P<m1>\d{1,2})[/. -](?P<d1>\d{1,2})"
+    r"|(?P<y2>\d{4})\s*年\s*(?P<m2>\d{1,2})\s*月\s*(?P<d2>\d{1,2})\s*日"
+)
+_RE_NONDIGIT = re.compile(r"\D")
+
 def to_yyyy_mm_dd(raw: str) -> str:
     """
     受け取った文字列を YYYY-MM-DD に正規化する。
@@ -42,26 +60,32 @@ def to_yyyy_mm_dd(raw: str) -> str:
     if not isinstance(raw, str):
         raise ValueError("birthdate must be a string")
 
-    s = raw.strip().translate(FULL2HALF)
+    s = raw.strip()
 
-    # まず区切り付き YYYY?MM?DD?
-    m = re.fullmatch(r"(\d{4})[/. -](\d{1,2})[/. -](\d{1,2})", s)
-    if m:
-        y, mm, dd = map(int, m.groups())
-        return f"{y:04d}-{mm:02d}-{dd:02d}"
+    # 高速パス: 既に YYYY-MM-DD / YYYYMMDD（半角数字）ならそのまま使う
+    if s.isascii():
+        if len(s) == 10 and s[4] == "-" and s[7] == "-" and s[:4].isdigit() and s[5:7].isdigit() and s[8:].isdigit():
+            return s
+        if len(s) == 8 and s.isdigit():
+            return f"{s[:4]}-{s[4:6]}-{s[6:]}"
+    else:
+        # 全角→半角変換は非ASCIIを含む入力のときだけ
+        s = s.translate(FULL2HALF)
 
-    # 日本語（YYYY年M月D日）
-    m = re.fullmatch(r"(\d{4})\s*年\s*(\d{1,2})\s*月\s*(\d{1,2})\s*日", s)
+    m = _RE_DATE.fullmatch(s)
     if m:
-        y, mm, dd = map(int, m.groups())
+        if m["y1"] is not None:  # 区切り付き YYYY?MM?DD
+            y, mm, dd = int(m["y1"]), int(m["m1"]), int(m["d1"])
+        else:  # 日本語（YYYY年M月D日）
+            y, mm, dd = int(m["y2"]), int(m["m2"]), int(m["d2"])
         return f"{y:04d}-{mm:02d}-{dd:02d}"
 
     # 数字だけ
-    digits = re.sub(r"\D", "", s)
-    if re.fullmatch(r"\d{8}", digits):  # YYYYMMDD
+    digits = _RE_NONDIGIT.sub("", s)
+    if len(digits) == 8:  # YYYYMMDD
         y, mm, dd = int(digits[:4]), int(digits[4:6]), int(digits[6:8])
         return f"{y:04d}-{mm:02d}-{dd:02d}"
-    if re.fullmatch(r"\d{6}", digits):  # YYMMDD（00-29→2000年代、30-99→1900年代）
+    if len(digits) == 6:  # YYMMDD（00-29→2000年代、30-99→1900年代）
         yy, mm, dd = int(digits[:2]), int(digits[2:4]), int(digits[4:6])
         y = 2000 + yy if yy <= 29 else 1900 + yy
         return f"{y:04d}-{mm:02d}-{dd:02d}"
@@ -71,6 +95,13 @@ def to_yyyy_mm_dd(raw: str) -> str:
 def yyyymmdd_int(d: str) -> int:
     return int(d.replace("-", ""))
 
+def master_date_int(v: Any) -> int:
+    # マスタの "YYYY-MM-DD"（"/" 区切りも可）をスライスで YYYYMMDD の int にする
+    s = str(v)
+    if len(s) != 10 or s[4] not in "-/" or s[7] not in "-/":
+        raise ValueError(f"{s!r} is not YYYY-MM-DD")
+    return int(s[0:4]) * 10000 + int(s[5:7]) * 100 + int(s[8:10])
+
 # -------------------------
 # I/O モデル
 # -------------------------
@@ -81,6 +112,16 @@ class DiagnoseIn(BaseModel):
     def _normalize(cls, v: str) -> str:
         return to_yyyy_mm_dd(v)
 
+    # 検索用の YYYYMMDD int は検証時に一度だけ作る（OpenAPI スキーマには出ない）
+    _birthdate_int: int = PrivateAttr(0)
+
+    def model_post_init(self, __context: Any) -> None:
+        self._birthdate_int = yyyymmdd_int(self.birthdate)
+
+    @property
+    def birthdate_int(self) -> int:
+        return self._birthdate_int
+
 class DiagnoseOut(BaseModel):
     dragon_head_zodiac: str
     dragon_tail_zodiac: str
@@ -91,26 +132,23 @@ class DiagnoseOut(BaseModel):
 # データ読み込み
 # -------------------------
 def _load_json(p: Path):
+    # マスタの不備は読込時にだけ起こりうるので、ここで明示的な 500 にする
     if not p.exists():
-        raise FileNotFoundError(str(p))
+        raise HTTPException(status_code=500, detail=f"Missing master file: {p}")
     with p.open("r", encoding="utf-8") as f:
-        return json.load(f)
-
-def load_ranges() -> List[Dict[str, Any]]:
-    # 期待スキーマ（一例）:
-    # {"start": "1969-04-20", "end": "1970-11-02", "dragon_head_zodiac": "魚座"}
-    return _load_json(DATA_DIR / "dragon_head_ranges.json")
+        try:
+            return json.load(f)
+        except ValueError as e:
+            raise HTTPException(status_code=500, detail=f"Invalid master JSON {p.name}: {e}")
 
-def load_zodiac_theme_map() -> Dict[str, Dict[str, str]]:
-    # 期待スキーマ（一例）:
-    # {"牡牛座":{"dragon_tail_zodiac":"蠍座","soul_theme":"2-1","reverse_theme":"4-2"}, ...}
-    return _load_json(DATA_DIR / "zodiac_theme_map.json")
+class RangeTable(NamedTuple):
+    # 行ごとの dict ではなく列ごとの配列で保持（日付は YYYYMMDD の int）
+    starts: array
+    ends: array
+    heads: Tuple[str, ...]
 
-# -------------------------
-# コアロジック
-# -------------------------
-def find_head_zodiac(bd_str: str, ranges: List[Dict[str, Any]]) -> str:
-    bd = yyyymmdd_int(bd_str)
+def build_range_table(ranges: List[Dict[str, Any]]) -> RangeTable:
+    rows: List[Tuple[int, int, str]] = []
     for row in ranges:
         # キー名ゆらぎ対応
         start = row.get("start_date") or row.get("start") or row.get("from")
@@ -121,52 +159,217 @@ def find_head_zodiac(bd_str: str, ranges: List[Dict[str, Any]]) -> str:
             continue
 
         try:
-            s_int = yyyymmdd_int(str(start).replace("/", "-"))
-            e_int = yyyymmdd_int(str(end).replace("/", "-"))
-        except Exception as exc:
+            s_int = master_date_int(start)
+            e_int = master_date_int(end)
+        except ValueError as exc:
             raise HTTPException(status_code=500, detail=f"Invalid range date format: {exc}")
 
-        if s_int <= bd <= e_int:
-            return head
+        rows.append((s_int, e_int, head))
+
+    # 二分探索のため start 昇順に並べておく
+    rows.sort()
+
+    # 二分探索はレンジが互いに重ならない前提なので、崩れたマスタは黙って誤判定せず 500 にする
+    prev_end = None
+    for s_int, e_int, head in rows:
+        if s_int > e_int:
+            raise HTTPException(status_code=500, detail=f"Invalid range: start after end ({s_int}..{e_int} {head})")
+        if prev_end is not None and s_int <= prev_end:
+            raise HTTPException(status_code=500, detail=f"Overlapping ranges in master at {s_int} ({head})")
+        prev_end = e_int
+
+    return RangeTable(
+        array("i", (r[0] for r in rows)),
+        array("i", (r[1] for r in rows)),
+        tuple(r[2] for r in rows),
+    )
+
+# マスタは不変なので一度だけ読む（読込失敗時は例外がキャッシュされず次回再試行）
+@lru_cache(maxsize=1)
+def load_ranges() -> RangeTable:
+    # 期待スキーマ（一例）:
+    # {"start": "1969-04-20", "end": "1970-11-02", "dragon_head_zodiac": "魚座"}
+    return build_range_table(_load_json(RANGES_PATH))
+
+@lru_cache(maxsize=1)
+def load_zodiac_theme_map() -> Dict[str, Dict[str, str]]:
+    # 期待スキーマ（一例）:
+    # {"牡牛座":{"dragon_tail_zodiac":"蠍座","soul_theme":"2-1","reverse_theme":"4-2"}, ...}
+    return _load_json(ZMAP_PATH)
+
+# tail は zmap から取得（レンジJSONに無くてもOK）
+ZMAP_REQUIRED = ("dragon_tail_zodiac", "soul_theme", "reverse_theme")
+
+def build_response_bodies(zmap: Dict[str, Dict[str, str]]) -> Dict[str, bytes]:
+    # head 星座は12通りしかないので、レスポンスJSONを head ごとに事前シリアライズしておく
+    bodies: Dict[str, bytes] = {}
+    for head, info in zmap.items():
+        if info and all(k in info for k in ZMAP_REQUIRED):
+            bodies[head] = orjson.dumps({
+                "dragon_head_zodiac": head,
+                "dragon_tail_zodiac": info["dragon_tail_zodiac"],
+                "soul_theme": info["soul_theme"],
+                "reverse_theme": info["reverse_theme"],
+            })
+    return bodies
+
+@lru_cache(maxsize=1)
+def load_response_bodies() -> Dict[str, bytes]:
+    return build_response_bodies(load_zodiac_theme_map())
+
+_master_stamp: Optional[Tuple[int, ...]] = None
+
+def reload_master_if_changed() -> None:
+    global _master_stamp
+    stamp = tuple(p.stat().st_mtime_ns if p.exists() else 0 for p in (RANGES_PATH, ZMAP_PATH))
+    if stamp != _master_stamp:
+        load_ranges.cache_clear()
+        load_zodiac_theme_map.cache_clear()
+        load_response_bodies.cache_clear()
+        diagnose_body.cache_clear()
+        _master_stamp = stamp
+
+# -------------------------
+# コアロジック
+# -------------------------
+def find_head_zodiac(bd: int, ranges: RangeTable) -> str:
+    # bd 以下で最大の start を持つ行が唯一の候補（レンジは互いに重ならない）
+    i = bisect_right(ranges.starts, bd) - 1
+    if i >= 0 and bd <= ranges.ends[i]:
+        return ranges.heads[i]
 
     raise HTTPException(status_code=422, detail="Birthdate is outside of supported master ranges.")
 
+# 生年月日→結果は決定的なので、正規化済みの int をキーに結果JSONごとメモ化する
+# （例外は lru_cache に載らないので 422/500 は毎回判定される）
+@lru_cache(maxsize=65536)
+def diagnose_body(bd: int) -> bytes:
+    head = find_head_zodiac(bd, load_ranges())
+
+    body = load_response_bodies().get(head)
+    if body is None:
+        info = load_zodiac_theme_map().get(head)
+        if not info:
+            raise HTTPException(status_code=500, detail=f"zodiac_theme_map missing {head}")
+        raise HTTPException(status_code=500, detail=f"zodiac_theme_map keys missing for {head}: {list(ZMAP_REQUIRED)}")
+    return body
+
 # -------------------------
 # Endpoints
 # -------------------------
+# LB から高頻度で叩かれるので、タイムスタンプ文字列は秒単位で使い回す
+_health_ts: Tuple[int, str] = (0, "")
+
+def _utc_timestamp() -> str:
+    global _health_ts
+    now = int(time.time())
+    sec, ts = _health_ts
+    if now != sec:
+        ts = datetime.fromtimestamp(now, timezone.utc).isoformat().replace("+00:00", "Z")
+        _health_ts = (now, ts)
+    return ts
+
 @app.get("/health")
 def health():
-    return {"ok": True, "timestamp": datetime.utcnow().isoformat() + "Z"}
+    return {"ok": True, "timestamp": _utc_timestamp()}
 
-@app.post("/diagnose", response_model=DiagnoseOut)
+# 結果は生年月日だけで決まるのでクライアント側キャッシュを許可する
+# （マスタ差し替えがありうるので1日まで）
+DIAGNOSE_CACHE_CONTROL = "public, max-age=86400"
+
+# 返り値は信頼済みマスタから事前シリアライズ済みなので response_model による再検証はしない
+# （スキーマは responses= で OpenAPI にだけ載せる）
+@app.post("/diagnose", responses={200: {"model": DiagnoseOut}})
 def diagnose(payload: DiagnoseIn):
-    # 外から入った birthdate はここまでで YYYY-MM-DD に正規化済み
-    try:
-        ranges = load_ranges()
-        zmap   = load_zodiac_theme_map()
-        head   = find_head_zodiac(payload.birthdate, ranges)
+    # 外から入った birthdate はここまでで YYYY-MM-DD に正規化済み（birthdate_int も算出済み）
+    # マスタ由来のエラーは HTTPException で上がってくる。想定外の例外は Starlette の 500 に任せる
+    if MASTER_RELOAD:
+        reload_master_if_changed()
+    return Response(
+        content=diagnose_body(payload.birthdate_int),
+        media_type="application/json",
+        headers={"cache-control": DIAGNOSE_CACHE_CONTROL},
+    )
 
-        info = zmap.get(head)
-        if not info:
-            raise HTTPException(status_code=500, detail=f"zodiac_theme_map missing {head}")
+# -------------------------
+# /diagnose 高速パス（ASGI）
+# -------------------------
+class DiagnoseFastPath:
+    """
+    POST /diagnose の正常系だけを FastAPI のルーティング/DI/シリアライズを通さずに返す。
+    判定できない入力やエラーになる入力は、読み込んだボディを再生して通常のルートへ渡す
+    （422/500 のレスポンス形式と OpenAPI は従来のまま）。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != "/diagnose" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        chunks = []
+        more = True
+        while more:
+            msg = await receive()
+            if msg["type"] != "http.request":  # http.disconnect
+                return
+            chunks.append(msg.get("body", b""))
+            more = msg.get("more_body", False)
+        body = b"".join(chunks)
+
+        out = self._try_diagnose(scope, body)
+        if out is not None:
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(out)).encode()),
+                    (b"cache-control", DIAGNOSE_CACHE_CONTROL.encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": out})
+            return
+
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(scope, replay, send)
+
+    @staticmethod
+    def _try_diagnose(scope, body: bytes) -> Optional[bytes]:
+        # FastAPI が JSON として読む Content-Type（application/json か +json）だけ扱い、他は通常ルートへ
+        content_type = next((v for k, v in scope["headers"] if k == b"content-type"), b"")
+        media_type = content_type.split(b";", 1)[0].strip().lower()
+        if not (media_type == b"application/json" or (media_type.startswith(b"application/") and media_type.endswith(b"+json"))):
+            return None
+        try:
+            payload = orjson.loads(body)
+            bd = yyyymmdd_int(to_yyyy_mm_dd(payload["birthdate"]))
+            if MASTER_RELOAD:
+                reload_master_if_changed()
+            return diagnose_body(bd)
+        except (ValueError, TypeError, KeyError, HTTPException):
+            return None
 
-        # tail は zmap から取得（レンジJSONに無くてもOK）
-        required = ["dragon_tail_zodiac", "soul_theme", "reverse_theme"]
-        if not all(k in info for k in required):
-            raise HTTPException(status_code=500, detail=f"zodiac_theme_map keys missing for {head}: {required}")
-
-        return DiagnoseOut(
-            dragon_head_zodiac=head,
-            dragon_tail_zodiac=info["dragon_tail_zodiac"],
-            soul_theme=info["soul_theme"],
-            reverse_theme=info["reverse_theme"],
-        )
-
-    except HTTPException:
-        raise
-    except ValueError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except FileNotFoundError as e:
-        raise HTTPException(status_code=500, detail=f"Missing master file: {e}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Internal error: {e}")
+# CORS が高速パスのレスポンスにもかかるよう、高速パスの外側に積む
+app.add_middleware(DiagnoseFastPath)
+# ブラウザから叩くツール用。CORS_ALLOW_ORIGINS（カンマ区切り、"*" も可）を指定したときだけ有効。
+# サーバ間呼び出し（GPTs Actions 等）では不要なので、未指定ならミドルウェア自体を積まない
+CORS_ALLOW_ORIGINS = [o.strip() for o in os.getenv("CORS_ALLOW_ORIGINS", "").split(",") if o.strip()]
+if CORS_ALLOW_ORIGINS:
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=CORS_ALLOW_ORIGINS,
+        allow_methods=["GET", "POST"],
+        allow_headers=["Content-Type"],
+        max_age=86400,  # プリフライト結果をブラウザに1日キャッシュさせる
+    )
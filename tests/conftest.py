@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# テストから `app.main` を uvicorn と同じモジュールパスで import できるようにする
+sys.path.append(str(Path(__file__).resolve().parents[1]))
@@ -1,32 +1,135 @@
 
-import json
-from pathlib import Path
+import pytest
+from fastapi import HTTPException
 from fastapi.testclient import TestClient
 
-import sys
-sys.path.append(str(Path(__file__).resolve().parents[1] / "app"))
-from main import app  # type: ignore
+from app import main as main_mod  # type: ignore
+from app.main import app  # type: ignore
 
 client = TestClient(app)
 
+CASES = [
+    ("1970-07-24", {"dragon_head_zodiac":"魚座","dragon_tail_zodiac":"乙女座","soul_theme":"4-3","reverse_theme":"2-2"}),
+    ("1965-03-18", {"dragon_head_zodiac":"双子座","dragon_tail_zodiac":"射手座","soul_theme":"3-1","reverse_theme":"1-3"}),
+    ("1940-04-07", {"dragon_head_zodiac":"天秤座","dragon_tail_zodiac":"牡羊座","soul_theme":"3-2","reverse_theme":"1-1"}),
+    ("1966-04-29", {"dragon_head_zodiac":"牡牛座","dragon_tail_zodiac":"蠍座","soul_theme":"2-1","reverse_theme":"4-2"}),
+    ("1971-01-11", {"dragon_head_zodiac":"水瓶座","dragon_tail_zodiac":"獅子座","soul_theme":"3-3","reverse_theme":"1-2"}),
+]
+
+def _warm_caches():
+    for bd, _ in CASES:
+        client.post("/diagnose", json={"birthdate": bd})
+
+@pytest.fixture(scope="module", autouse=True)
+def _warm():
+    # マスタ読込・事前シリアライズ・結果キャッシュを先に温め、各テストは本番同様の定常状態で動かす
+    _warm_caches()
+
 def _post(date_str: str):
     return client.post("/diagnose", json={"birthdate": date_str})
 
 def test_health():
     r = client.get("/health")
     assert r.status_code == 200
+    out = r.json()
+    assert out["ok"] is True
+    assert out["timestamp"].endswith("Z")
 
 def test_known_cases_master_ver1():
-    cases = [
-        ("1970-07-24", {"dragon_head_zodiac":"魚座","dragon_tail_zodiac":"乙女座","soul_theme":"4-3","reverse_theme":"2-2"}),
-        ("1965-03-18", {"dragon_head_zodiac":"双子座","dragon_tail_zodiac":"射手座","soul_theme":"3-1","reverse_theme":"1-3"}),
-        ("1940-04-07", {"dragon_head_zodiac":"天秤座","dragon_tail_zodiac":"牡羊座","soul_theme":"3-2","reverse_theme":"1-1"}),
-        ("1966-04-29", {"dragon_head_zodiac":"牡牛座","dragon_tail_zodiac":"蠍座","soul_theme":"2-1","reverse_theme":"4-2"}),
-        ("1971-01-11", {"dragon_head_zodiac":"水瓶座","dragon_tail_zodiac":"獅子座","soul_theme":"3-3","reverse_theme":"1-2"}),
-    ]
-    for bd, expected in cases:
+    for bd, expected in CASES:
         r = _post(bd)
         assert r.status_code == 200, (bd, r.status_code, r.text)
+        assert r.headers["content-type"] == "application/json"
+        assert r.headers["cache-control"].startswith("public")
         out = r.json()
         for k, v in expected.items():
             assert out[k] == v, f"{bd}: expected {k}={v}, got {out[k]}"
+
+def test_master_range_boundaries():
+    # 対応範囲の両端は 200、その外側は 422
+    assert _post("1936-09-15").status_code == 200
+    assert _post("2048-04-11").status_code == 200
+    assert _post("1936-09-14").status_code == 422
+    assert _post("2048-04-12").status_code == 422
+
+def test_overlapping_master_ranges_rejected():
+    # レンジが重なる／逆転したマスタは二分探索で誤判定しうるので 500 で弾く
+    overlapping = [
+        {"start": "1960-01-01", "end": "1970-12-31", "dragon_head_zodiac": "A"},
+        {"start": "1965-01-01", "end": "1966-01-01", "dragon_head_zodiac": "B"},
+    ]
+    reversed_ = [{"start": "1970-01-01", "end": "1969-12-31", "dragon_head_zodiac": "A"}]
+    for ranges in (overlapping, reversed_):
+        with pytest.raises(HTTPException) as exc:
+            main_mod.build_range_table(ranges)
+        assert exc.value.status_code == 500
+
+def test_openapi_documents_diagnose_out():
+    # GPTs Actions は OpenAPI のレスポンススキーマを読むので残っていること
+    spec = client.get("/openapi.json").json()
+    schema = spec["paths"]["/diagnose"]["post"]["responses"]["200"]["content"]["application/json"]["schema"]
+    assert schema == {"$ref": "#/components/schemas/DiagnoseOut"}
+
+def test_birthdate_formats_normalized():
+    # 高速パス（YYYY-MM-DD / YYYYMMDD）と正規表現パスで同じ結果になること
+    expected = _post("1970-07-24").json()
+    for raw in ["19700724", " 1970-07-24 ", "1970/7/24", "1970.7.24", "1970年7月24日", "１９７０／０７／２４", "700724"]:
+        r = _post(raw)
+        assert r.status_code == 200, (raw, r.status_code, r.text)
+        assert r.json() == expected, raw
+    assert _post("not-a-date").status_code == 422
+
+def _clear_master_caches():
+    main_mod.load_ranges.cache_clear()
+    main_mod.diagnose_body.cache_clear()
+
+def test_missing_master_returns_500(monkeypatch, tmp_path):
+    monkeypatch.setattr(main_mod, "RANGES_PATH", tmp_path / "missing.json")
+    _clear_master_caches()
+    try:
+        r = _post("1970-07-24")
+        assert r.status_code == 500
+        assert r.json()["detail"].startswith("Missing master file")
+    finally:
+        monkeypatch.undo()
+        _clear_master_caches()
+        # 後続のテストも定常状態で動くよう温め直す
+        _warm_caches()
+
+def test_invalid_payload_falls_back_to_validation_errors():
+    # 高速パスで扱えない入力は通常ルートの 422（FastAPI 形式）になること
+    for kwargs in [
+        {"json": {"birthdate": "not-a-date"}},
+        {"json": {"birthdate": 19700724}},
+        {"json": {}},
+        {"content": b"{", "headers": {"Content-Type": "application/json"}},
+    ]:
+        r = client.post("/diagnose", **kwargs)
+        assert r.status_code == 422, (kwargs, r.text)
+        assert isinstance(r.json()["detail"], list)
+    # JSON 以外の Content-Type は高速パスでも 422（jsonl / json-seq も JSON 扱いしない）
+    for ct in ["application/jsonl", "application/json-seq", "text/plain"]:
+        r = client.post("/diagnose", content=b'{"birthdate":"1970-07-24"}', headers={"Content-Type": ct})
+        assert r.status_code == 422, (ct, r.text)
+    # 範囲外は従来どおり文字列の detail
+    r = _post("2100-01-01")
+    assert r.status_code == 422
+    assert r.json()["detail"] == "Birthdate is outside of supported master ranges."
+
+def test_json_content_type_variants_accepted():
+    for ct in ["APPLICATION/JSON", "application/json; charset=utf-8", "application/vnd.api+json"]:
+        r = client.post("/diagnose", content=b'{"birthdate":"1970-07-24"}', headers={"Content-Type": ct})
+        assert r.status_code == 200, (ct, r.text)
+
+def test_fast_path_answers_directly():
+    # 高速パス自体が正常系を返し、扱えない入力では None（通常ルートへ委譲）になること
+    try_diagnose = main_mod.DiagnoseFastPath._try_diagnose
+    scope = {"headers": [(b"content-type", b"application/json")]}
+    out = try_diagnose(scope, b'{"birthdate":"1970-07-24"}')
+    assert out is not None
+    assert out == _post("1970-07-24").content
+    assert try_diagnose({"headers": [(b"content-type", b"Application/Json; charset=utf-8")]}, b'{"birthdate":"1970-07-24"}') == out
+    for body in [b"{", b'{"birthdate": 19700724}', b"{}", b'{"birthdate":"2100-01-01"}']:
+        assert try_diagnose(scope, body) is None, body
+    for ct in [b"application/jsonl", b"application/json-seq", b"text/plain"]:
+        assert try_diagnose({"headers": [(b"content-type", ct)]}, b'{"birthdate":"1970-07-24"}') is None, ct